@@ -9,10 +9,24 @@ Generates:
 
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Dict, List, Any, Optional
 from pathlib import Path
 import uuid
+from collections import Counter
+
+# Optional fast encoder (graceful fallback to stdlib json if not installed)
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None  # type: ignore
+
+
+def _json_default(obj: Any) -> Any:
+    """Encode values JSON has no type for; shared by both encoders so flag files match."""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    return str(obj)
 
 
 class FlagDataGenerator:
@@ -32,6 +46,9 @@ class FlagDataGenerator:
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
         self.flagged_sessions: Dict[str, List[Dict[str, Any]]] = {}
+        self.session_risk_counts: Dict[str, Counter] = {}  # session_id -> flags per risk level
+        self.flag_paths: Dict[str, Path] = {}  # flag_id -> file written by this generator
+        self._session_dirs: Dict[str, Path] = {}  # session_id -> directory already created
     
     def create_flag_file(
         self,
@@ -40,6 +57,7 @@ class FlagDataGenerator:
         patterns: List[Dict[str, Any]],
         session_id: str,
         student_id: str,
+        timestamp: Optional[datetime] = None,
     ) -> Dict[str, Any]:
         """
         Create a standardized flag file for suspicious activity.
@@ -50,12 +68,14 @@ class FlagDataGenerator:
             patterns: Detected patterns
             session_id: Exam session ID
             student_id: Student identifier
+            timestamp: Detection time (default: now, UTC)
             
         Returns:
             Flag file metadata
         """
         flag_id = str(uuid.uuid4())
-        timestamp = datetime.utcnow()
+        if timestamp is None:
+            timestamp = datetime.now(timezone.utc)
         
         # Build flag data structure
         flag_data = {
@@ -98,14 +118,17 @@ class FlagDataGenerator:
         filename = self._save_flag_file(flag_data, session_id, student_id)
         
         # Track in memory
+        risk_level = classification.get("risk_level")
         if session_id not in self.flagged_sessions:
             self.flagged_sessions[session_id] = []
+            self.session_risk_counts[session_id] = Counter()
         self.flagged_sessions[session_id].append({
             "flag_id": flag_id,
             "filename": filename,
             "timestamp": timestamp,
-            "risk_level": classification.get("risk_level"),
+            "risk_level": risk_level,
         })
+        self.session_risk_counts[session_id][risk_level] += 1
         
         return {
             "flag_id": flag_id,
@@ -131,7 +154,8 @@ class FlagDataGenerator:
             Batch report metadata
         """
         report_id = str(uuid.uuid4())
-        timestamp = datetime.utcnow()
+        timestamp = datetime.now(timezone.utc)
+        risk_counts = Counter(f.get("risk_level") for f in flags)
         
         report = {
             "report_id": report_id,
@@ -139,9 +163,9 @@ class FlagDataGenerator:
             "session_id": session_id,
             "student_id": student_id,
             "total_flags": len(flags),
-            "critical_count": sum(1 for f in flags if f.get("risk_level") == "critical"),
-            "high_count": sum(1 for f in flags if f.get("risk_level") == "high"),
-            "medium_count": sum(1 for f in flags if f.get("risk_level") == "medium"),
+            "critical_count": risk_counts["critical"],
+            "high_count": risk_counts["high"],
+            "medium_count": risk_counts["medium"],
             "flags": flags,
             "summary": self._generate_batch_summary(flags),
             "recommendation": self._get_batch_recommendation(flags),
@@ -160,8 +184,17 @@ class FlagDataGenerator:
         """Get all flags for a session."""
         return self.flagged_sessions.get(session_id, [])
     
+    def get_session_risk_counts(self, session_id: str) -> Counter:
+        """Get flag counts per risk level for a session, kept up to date as flags are created."""
+        return self.session_risk_counts.get(session_id, Counter())
+    
     def get_flag_file_path(self, flag_id: str) -> Optional[Path]:
         """Get path to a flag file by ID."""
+        known = self.flag_paths.get(flag_id)
+        if known is not None and known.exists():
+            return known
+        
+        # Flags written by an earlier run are not indexed; fall back to a scan
         for session_dir in self.output_dir.iterdir():
             if session_dir.is_dir():
                 flag_file = session_dir / f"{flag_id}.json"
@@ -171,30 +204,71 @@ class FlagDataGenerator:
     
     def _save_flag_file(self, flag_data: Dict[str, Any], session_id: str, student_id: str) -> str:
         """Save individual flag file to disk."""
-        session_dir = self.output_dir / session_id
-        session_dir.mkdir(exist_ok=True)
+        session_dir = self._get_session_dir(session_id)
         
         filename = f"{flag_data['flag_id']}.json"
         filepath = session_dir / filename
         
-        with open(filepath, 'w') as f:
-            json.dump(flag_data, f, indent=2)
+        self._write_json(filepath, flag_data)
+        self.flag_paths[flag_data["flag_id"]] = filepath
         
         return str(filepath)
     
     def _save_batch_report(self, report: Dict[str, Any], session_id: str) -> str:
         """Save batch report to disk."""
-        session_dir = self.output_dir / session_id
-        session_dir.mkdir(exist_ok=True)
+        session_dir = self._get_session_dir(session_id)
         
         filename = f"batch_report_{report['report_id']}.json"
         filepath = session_dir / filename
         
-        with open(filepath, 'w') as f:
-            json.dump(report, f, indent=2)
+        self._write_json(filepath, report)
         
         return str(filepath)
     
+    def _get_session_dir(self, session_id: str) -> Path:
+        """Get a session's directory, creating it on first use only."""
+        session_dir = self._session_dirs.get(session_id)
+        if session_dir is None:
+            session_dir = self.output_dir / session_id
+            session_dir.mkdir(parents=True, exist_ok=True)
+            self._session_dirs[session_id] = session_dir
+        return session_dir
+    
+    def _write_json(self, filepath: Path, data: Dict[str, Any]) -> None:
+        """
+        Encode in memory and write the file in one call (json.dump issues a write per token).
+        
+        The payload goes to a temp file in the same directory and is renamed into
+        place, so readers never see a half-written flag file.
+        """
+        # Both branches emit the same bytes: UTF-8 without \u escapes, stringified
+        # non-str keys, and _json_default for everything else
+        if orjson is not None:
+            payload = orjson.dumps(
+                data,
+                default=_json_default,
+                option=(orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+                        | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS),
+            )
+        else:
+            payload = json.dumps(data, indent=2, ensure_ascii=False, default=_json_default).encode("utf-8")
+        
+        tmp_path = filepath.with_name(f".{filepath.name}.{os.getpid()}.tmp")
+        try:
+            try:
+                f = open(tmp_path, 'wb')
+            except FileNotFoundError:
+                # The cached session directory was cleaned up or rotated away
+                # while we ran; recreate it and try once more
+                filepath.parent.mkdir(parents=True, exist_ok=True)
+                f = open(tmp_path, 'wb')
+            with f:
+                f.write(payload)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+    
     def _summarize_package(self, package: Dict[str, Any]) -> Dict[str, Any]:
         """Create a summary of the original package."""
         return {
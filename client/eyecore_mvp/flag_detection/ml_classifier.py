@@ -9,7 +9,73 @@ Uses simple decision tree logic with weighted features to classify:
 """
 
 from typing import Dict, List, Any, Tuple, Optional
-import statistics
+from bisect import bisect_left
+
+# Risk multiplier per pattern severity (scaled by the pattern's confidence)
+SEVERITY_MULTIPLIERS = {"critical": 2.0, "high": 1.5, "medium": 1.2}
+
+# Recommended action per risk level
+RISK_RECOMMENDATIONS = {
+    "critical": "FLAG_IMMEDIATE - Stop exam and flag for review",
+    "high": "FLAG_SERVER - Send to server for Gemini analysis",
+    "medium": "MONITOR_CLOSE - Continue monitoring with increased sensitivity",
+    "low": "CONTINUE_NORMAL - Normal monitoring",
+}
+DEFAULT_RECOMMENDATION = "CONTINUE_NORMAL - No action needed"
+
+# Score bands: a score strictly above RISK_THRESHOLDS[i] falls into RISK_LEVELS[i + 1]
+RISK_THRESHOLDS = (0.25, 0.45, 0.65, 0.8)
+RISK_LEVELS = (
+    ("none", "✓ CLEAN - No suspicious activity detected"),
+    ("low", "ℹ️ LOW RISK - Minimal suspicious indicators"),
+    ("medium", "⚡ MEDIUM RISK - Monitor closely"),
+    ("high", "⚠️ HIGH RISK - Multiple suspicious indicators"),
+    ("critical", "🚨 CRITICAL - Immediate escalation required"),
+)
+
+# (package section, ((feature name, key in section, default), ...)) read by _extract_features
+FEATURE_SCHEMA = (
+    ("input_dynamics", (
+        ("keystroke_rhythm_variance", "keystroke_rhythm_variance", 0.0),
+        ("keystroke_error_rate", "keystroke_error_rate", 0.0),
+        ("keystroke_speed", "keystroke_speed", 0.0),
+        ("mouse_velocity", "mouse_velocity", 0.0),
+        ("mouse_idle_duration", "mouse_idle_duration", 0.0),
+    )),
+    ("network_activity", (
+        ("network_bytes_sent", "bytes_sent", 0),
+        ("network_bytes_received", "bytes_received", 0),
+    )),
+    ("system_metrics", (
+        ("cpu_usage", "cpu_usage", 0.0),
+        ("memory_usage", "memory_usage", 0.0),
+    )),
+    ("focus_metrics", (
+        ("focus_score", "focus_score", 0.5),
+        ("eye_contact", "eye_contact_percentage", 0.0),
+    )),
+    ("process_data", (
+        ("app_switches", "app_switches", 0),
+        ("active_window_title", "window_title", ""),
+    )),
+    ("voice_metrics", (
+        ("voice_sentiment", "sentiment_score", 0.0),
+        ("voice_pitch_variance", "pitch_variance", 0.0),
+    )),
+)
+
+
+def extract_features(package: Dict[str, Any]) -> Dict[str, float]:
+    """Flatten an activity package into the feature dict described by FEATURE_SCHEMA."""
+    features = {}
+    package_get = package.get
+    for section, fields in FEATURE_SCHEMA:
+        # Fetch each section once instead of once per field, and bind its
+        # lookup so the inner loop skips the attribute fetch
+        get = (package_get(section) or {}).get
+        for name, key, default in fields:
+            features[name] = get(key, default)
+    return features
 
 
 class MLClassifier:
@@ -39,19 +105,26 @@ class MLClassifier:
             "mouse_idle_duration": {"weight": 0.08, "threshold": 30, "type": "high_bad"},
         }
     
-    def classify(self, package: Dict[str, Any], patterns: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def classify(
+        self,
+        package: Dict[str, Any],
+        patterns: List[Dict[str, Any]],
+        features: Optional[Dict[str, float]] = None,
+    ) -> Dict[str, Any]:
         """
         Classify activity as suspicious or legitimate.
         
         Args:
             package: Activity package from client
             patterns: Detected patterns from PatternDetector
+            features: Features already extracted from this package, if any
             
         Returns:
             Classification with risk level, score, and reasoning
         """
         # Extract features from package
-        features = self._extract_features(package)
+        if features is None:
+            features = self._extract_features(package)
         
         # Calculate feature scores
         feature_scores = self._calculate_feature_scores(features)
@@ -84,34 +157,7 @@ class MLClassifier:
     
     def _extract_features(self, package: Dict[str, Any]) -> Dict[str, float]:
         """Extract numerical features from activity package."""
-        return {
-            # Input dynamics
-            "keystroke_rhythm_variance": package.get("input_dynamics", {}).get("keystroke_rhythm_variance", 0.0),
-            "keystroke_error_rate": package.get("input_dynamics", {}).get("keystroke_error_rate", 0.0),
-            "keystroke_speed": package.get("input_dynamics", {}).get("keystroke_speed", 0.0),
-            "mouse_velocity": package.get("input_dynamics", {}).get("mouse_velocity", 0.0),
-            "mouse_idle_duration": package.get("input_dynamics", {}).get("mouse_idle_duration", 0.0),
-            
-            # Network activity
-            "network_bytes_sent": package.get("network_activity", {}).get("bytes_sent", 0),
-            "network_bytes_received": package.get("network_activity", {}).get("bytes_received", 0),
-            
-            # System metrics
-            "cpu_usage": package.get("system_metrics", {}).get("cpu_usage", 0.0),
-            "memory_usage": package.get("system_metrics", {}).get("memory_usage", 0.0),
-            
-            # Focus & attention
-            "focus_score": package.get("focus_metrics", {}).get("focus_score", 0.5),
-            "eye_contact": package.get("focus_metrics", {}).get("eye_contact_percentage", 0.0),
-            
-            # Process data
-            "app_switches": package.get("process_data", {}).get("app_switches", 0),
-            "active_window_title": package.get("process_data", {}).get("window_title", ""),
-            
-            # Voice metrics
-            "voice_sentiment": package.get("voice_metrics", {}).get("sentiment_score", 0.0),
-            "voice_pitch_variance": package.get("voice_metrics", {}).get("pitch_variance", 0.0),
-        }
+        return extract_features(package)
     
     def _calculate_feature_scores(self, features: Dict[str, float]) -> Dict[str, float]:
         """
@@ -190,15 +236,9 @@ class MLClassifier:
         multiplier = 1.0
         
         for pattern in patterns:
-            severity = pattern.get("severity", "medium")
-            confidence = pattern.get("confidence", 0.5)
-            
-            if severity == "critical":
-                multiplier *= (2.0 * confidence)
-            elif severity == "high":
-                multiplier *= (1.5 * confidence)
-            elif severity == "medium":
-                multiplier *= (1.2 * confidence)
+            factor = SEVERITY_MULTIPLIERS.get(pattern.get("severity", "medium"))
+            if factor is not None:
+                multiplier *= factor * pattern.get("confidence", 0.5)
         
         # Cap multiplier at 2.5x
         return min(2.5, multiplier)
@@ -209,19 +249,11 @@ class MLClassifier:
         
         Returns: (risk_level, risk_label)
         """
-        # Check for critical patterns
-        has_critical_pattern = any(p.get("severity") == "critical" for p in patterns)
-        
-        if has_critical_pattern or score > 0.8:
-            return "critical", "🚨 CRITICAL - Immediate escalation required"
-        elif score > 0.65:
-            return "high", "⚠️ HIGH RISK - Multiple suspicious indicators"
-        elif score > 0.45:
-            return "medium", "⚡ MEDIUM RISK - Monitor closely"
-        elif score > 0.25:
-            return "low", "ℹ️ LOW RISK - Minimal suspicious indicators"
-        else:
-            return "none", "✓ CLEAN - No suspicious activity detected"
+        # Critical patterns escalate regardless of score
+        if any(p.get("severity") == "critical" for p in patterns):
+            return RISK_LEVELS[-1]
+        
+        return RISK_LEVELS[bisect_left(RISK_THRESHOLDS, score)]
     
     def _generate_explanation(
         self,
@@ -286,17 +318,7 @@ class MLClassifier:
     
     def _get_recommendation(self, risk_level: str, patterns: List[Dict[str, Any]]) -> str:
         """Get recommended action based on risk level."""
-        
-        if risk_level == "critical":
-            return "FLAG_IMMEDIATE - Stop exam and flag for review"
-        elif risk_level == "high":
-            return "FLAG_SERVER - Send to server for Gemini analysis"
-        elif risk_level == "medium":
-            return "MONITOR_CLOSE - Continue monitoring with increased sensitivity"
-        elif risk_level == "low":
-            return "CONTINUE_NORMAL - Normal monitoring"
-        else:
-            return "CONTINUE_NORMAL - No action needed"
+        return RISK_RECOMMENDATIONS.get(risk_level, DEFAULT_RECOMMENDATION)
 
 
 class EnsembleClassifier:
@@ -310,7 +332,8 @@ class EnsembleClassifier:
         self,
         package: Dict[str, Any],
         patterns: List[Dict[str, Any]],
-        historical_context: Optional[Dict[str, Any]] = None
+        historical_context: Optional[Dict[str, Any]] = None,
+        features: Optional[Dict[str, float]] = None,
     ) -> Dict[str, Any]:
         """
         Classify using ensemble method.
@@ -318,7 +341,7 @@ class EnsembleClassifier:
         Returns consensus with confidence.
         """
         # Primary ML classification
-        primary_result = self.primary_classifier.classify(package, patterns)
+        primary_result = self.primary_classifier.classify(package, patterns, features)
         
         # Historical context adjustment
         if historical_context and historical_context.get("student_baseline"):
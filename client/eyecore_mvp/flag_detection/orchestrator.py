@@ -10,16 +10,17 @@ Processes packages through the pipeline:
 """
 
 import logging
+from collections import Counter
 from typing import Dict, List, Any, Optional
-from datetime import datetime
+from datetime import datetime, timezone
 
 try:
     from .pattern_detector import PatternDetector
-    from .ml_classifier import MLClassifier, EnsembleClassifier
+    from .ml_classifier import MLClassifier, EnsembleClassifier, extract_features
     from .flag_data_generator import FlagDataGenerator, FlagDataCache
 except ImportError:
     from pattern_detector import PatternDetector
-    from ml_classifier import MLClassifier, EnsembleClassifier
+    from ml_classifier import MLClassifier, EnsembleClassifier, extract_features
     from flag_data_generator import FlagDataGenerator, FlagDataCache
 
 logger = logging.getLogger(__name__)
@@ -76,10 +77,14 @@ class FlagDetectionOrchestrator:
         self.stats["total_packages"] += 1
         self.stats["sessions_monitored"].add(session_id)
         
-        timestamp = datetime.utcnow().isoformat()
+        # One clock read per package, shared by the result and any flag file
+        now = datetime.now(timezone.utc)
+        timestamp = now.isoformat()
         
-        # Step 1: Add to pattern detector's history
-        self.pattern_detector.add_activity(package)
+        # Step 1: Add to pattern detector's history. Features are read from the
+        # package once here and shared with the classifier in step 3.
+        features = extract_features(package)
+        self.pattern_detector.add_activity(package, features)
         
         # Step 2: Detect patterns
         pattern_analysis = self.pattern_detector.detect_patterns()
@@ -92,7 +97,8 @@ class FlagDetectionOrchestrator:
         classification = self.ml_classifier.classify_ensemble(
             package,
             patterns,
-            historical_context
+            historical_context,
+            features,
         )
         
         # Step 4: Determine if should create flag file
@@ -117,7 +123,8 @@ class FlagDetectionOrchestrator:
                 classification,
                 patterns,
                 session_id,
-                student_id
+                student_id,
+                timestamp=now,
             )
             
             flag_file = flag_result["data"]
@@ -173,6 +180,8 @@ class FlagDetectionOrchestrator:
             if result["should_flag"]:
                 flagged_packages.append(result)
         
+        risk_counts = Counter(r["risk_level"] for r in results)
+        
         # Create batch report if there are flags
         batch_report = None
         if flagged_packages:
@@ -192,24 +201,25 @@ class FlagDetectionOrchestrator:
             "results": results,
             "batch_report": batch_report,
             "statistics": {
-                "critical": sum(1 for r in results if r["risk_level"] == "critical"),
-                "high": sum(1 for r in results if r["risk_level"] == "high"),
-                "medium": sum(1 for r in results if r["risk_level"] == "medium"),
-                "low": sum(1 for r in results if r["risk_level"] == "low"),
-                "clean": sum(1 for r in results if r["risk_level"] == "none"),
+                "critical": risk_counts["critical"],
+                "high": risk_counts["high"],
+                "medium": risk_counts["medium"],
+                "low": risk_counts["low"],
+                "clean": risk_counts["none"],
             }
         }
     
     def get_session_summary(self, session_id: str) -> Dict[str, Any]:
         """Get summary of flags for a session."""
         session_flags = self.flag_generator.get_session_flags(session_id)
+        risk_counts = self.flag_generator.get_session_risk_counts(session_id)
         
         return {
             "session_id": session_id,
             "total_flags": len(session_flags),
-            "critical_count": sum(1 for f in session_flags if f.get("risk_level") == "critical"),
-            "high_count": sum(1 for f in session_flags if f.get("risk_level") == "high"),
-            "medium_count": sum(1 for f in session_flags if f.get("risk_level") == "medium"),
+            "critical_count": risk_counts["critical"],
+            "high_count": risk_counts["high"],
+            "medium_count": risk_counts["medium"],
             "flags": session_flags,
         }
     
@@ -243,7 +253,7 @@ class FlagDetectionOrchestrator:
         
         export_data = {
             "session_id": session_id,
-            "exported_at": datetime.utcnow().isoformat(),
+            "exported_at": datetime.now(timezone.utc).isoformat(),
             "flags": session_flags,
             "summary": self.get_session_summary(session_id),
             "client_statistics": self.get_statistics(),
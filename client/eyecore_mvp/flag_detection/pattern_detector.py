@@ -8,40 +8,85 @@ Detects:
 - Temporal inconsistencies
 """
 
-import statistics
+from math import fsum
 from typing import Dict, List, Any, Optional
 from collections import deque
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+
+try:
+    from .ml_classifier import extract_features
+except ImportError:
+    from ml_classifier import extract_features
+
+# Shared read-only result for detectors that found nothing; only
+# detected patterns are ever copied into the output.
+_NOT_DETECTED = MappingProxyType({"detected": False})
+
+
+def _mean(values) -> float:
+    """Arithmetic mean of a short float sequence.
+
+    statistics.mean converts every value to an exact fraction first, which
+    costs far more than the comparisons the detectors actually make.
+    """
+    return fsum(values) / len(values)
 
 
 class PatternDetector:
     """Detects statistical patterns in activity data."""
     
+    # Detectors compare the last 5 samples against the 5 before them,
+    # so nothing older than 10 entries is ever read. This count cap, not
+    # the time window, is what bounds history at normal package rates.
+    HISTORY_MAXLEN = 10
+    
     def __init__(self, history_window_minutes: int = 5):
         """
         Initialize pattern detector.
         
         Args:
-            history_window_minutes: How far back to analyze patterns
+            history_window_minutes: Maximum age of kept samples. History
+                never holds more than HISTORY_MAXLEN samples either, so this
+                only takes effect when packages arrive slower than that many
+                per window, e.g. after a pause, where it keeps detectors from
+                comparing against stale activity.
         """
         self.history_window = history_window_minutes * 60  # seconds
         self.history: Dict[str, deque] = {
-            "keystroke_rhythm_variance": deque(),
-            "focus_score": deque(),
-            "stress_level": deque(),
-            "network_bytes": deque(),
-            "cpu_usage": deque(),
-            "app_switches": deque(),
-            "timestamps": deque(),
+            key: deque(maxlen=self.HISTORY_MAXLEN)
+            for key in (
+                "keystroke_rhythm_variance",
+                "focus_score",
+                "stress_level",
+                "network_bytes",
+                "cpu_usage",
+                "app_switches",
+                "timestamps",
+            )
         }
         
-    def add_activity(self, package: Dict[str, Any]) -> None:
-        """Add activity package to history."""
-        timestamp = datetime.fromisoformat(package.get("timestamp", datetime.utcnow().isoformat()))
+    def add_activity(self, package: Dict[str, Any], features: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Add activity package to history.
+        
+        Args:
+            package: Activity package from client
+            features: extract_features(package), when the caller already has it
+        """
+        if features is None:
+            features = extract_features(package)
+        
+        raw_ts = package.get("timestamp")
+        # Parse once and keep the datetime; the default is only built when absent
+        timestamp = datetime.fromisoformat(raw_ts) if raw_ts else datetime.now(timezone.utc)
+        if timestamp.tzinfo is None:
+            # Naive timestamps are UTC; keep history comparable with aware ones
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
         cutoff = timestamp - timedelta(seconds=self.history_window)
         
         # Remove old entries
-        while self.history["timestamps"] and datetime.fromisoformat(self.history["timestamps"][0]) < cutoff:
+        while self.history["timestamps"] and self.history["timestamps"][0] < cutoff:
             self.history["timestamps"].popleft()
             self.history["keystroke_rhythm_variance"].popleft()
             self.history["focus_score"].popleft()
@@ -51,28 +96,17 @@ class PatternDetector:
             self.history["app_switches"].popleft()
         
         # Add new entry
-        self.history["timestamps"].append(package.get("timestamp", datetime.utcnow().isoformat()))
-        self.history["keystroke_rhythm_variance"].append(
-            package.get("input_dynamics", {}).get("keystroke_rhythm_variance", 0.0)
-        )
-        self.history["focus_score"].append(
-            package.get("focus_metrics", {}).get("focus_score", 0.5)
-        )
-        self.history["stress_level"].append(
-            self._calculate_stress_level(package)
-        )
+        self.history["timestamps"].append(timestamp)
+        self.history["keystroke_rhythm_variance"].append(features["keystroke_rhythm_variance"])
+        self.history["focus_score"].append(features["focus_score"])
+        self.history["stress_level"].append(self._calculate_stress_level(features))
         self.history["network_bytes"].append(
-            package.get("network_activity", {}).get("bytes_sent", 0) + 
-            package.get("network_activity", {}).get("bytes_received", 0)
-        )
-        self.history["cpu_usage"].append(
-            package.get("system_metrics", {}).get("cpu_usage", 0.0)
-        )
-        self.history["app_switches"].append(
-            package.get("process_data", {}).get("app_switches", 0)
+            features["network_bytes_sent"] + features["network_bytes_received"]
         )
+        self.history["cpu_usage"].append(features["cpu_usage"])
+        self.history["app_switches"].append(features["app_switches"])
     
-    def _calculate_stress_level(self, package: Dict[str, Any]) -> float:
+    def _calculate_stress_level(self, features: Dict[str, Any]) -> float:
         """
         Calculate stress level from multiple signals (0-1).
         
@@ -84,15 +118,13 @@ class PatternDetector:
         stress = 0.0
         
         # Keystroke erraticism
-        keystroke_var = package.get("input_dynamics", {}).get("keystroke_rhythm_variance", 0.0)
-        stress += min(1.0, keystroke_var) * 0.4
+        stress += min(1.0, features["keystroke_rhythm_variance"]) * 0.4
         
         # Mouse velocity (jerky = stressed)
-        mouse_velocity = package.get("input_dynamics", {}).get("mouse_velocity", 0.0)
-        stress += min(1.0, mouse_velocity / 100) * 0.3
+        stress += min(1.0, features["mouse_velocity"] / 100) * 0.3
         
         # Voice sentiment (if available)
-        voice_sentiment = package.get("voice_metrics", {}).get("sentiment_score", 0.0)
+        voice_sentiment = features["voice_sentiment"]
         if voice_sentiment < 0:
             stress += abs(voice_sentiment) * 0.3
         
@@ -109,36 +141,17 @@ class PatternDetector:
             return {"patterns_detected": [], "severity": "low", "confidence": 0.0}
         
         patterns = []
-        
-        # Pattern 1: Biometric Drift (keystroke changes)
-        keystroke_drift = self._detect_biometric_drift()
-        if keystroke_drift["detected"]:
-            patterns.append(keystroke_drift)
-        
-        # Pattern 2: Focus Collapse
-        focus_collapse = self._detect_focus_collapse()
-        if focus_collapse["detected"]:
-            patterns.append(focus_collapse)
-        
-        # Pattern 3: Stress Spike
-        stress_spike = self._detect_stress_spike()
-        if stress_spike["detected"]:
-            patterns.append(stress_spike)
-        
-        # Pattern 4: Network Anomaly
-        network_anomaly = self._detect_network_anomaly()
-        if network_anomaly["detected"]:
-            patterns.append(network_anomaly)
-        
-        # Pattern 5: Resource Exhaustion
-        resource_exhaustion = self._detect_resource_exhaustion()
-        if resource_exhaustion["detected"]:
-            patterns.append(resource_exhaustion)
-        
-        # Pattern 6: Temporal Inconsistency
-        temporal_inconsistency = self._detect_temporal_inconsistency()
-        if temporal_inconsistency["detected"]:
-            patterns.append(temporal_inconsistency)
+        for detect in (
+            self._detect_biometric_drift,
+            self._detect_focus_collapse,
+            self._detect_stress_spike,
+            self._detect_network_anomaly,
+            self._detect_resource_exhaustion,
+            self._detect_temporal_inconsistency,
+        ):
+            result = detect()
+            if result["detected"]:
+                patterns.append(result)
         
         # Calculate overall severity
         severity = self._calculate_overall_severity(patterns)
@@ -157,16 +170,17 @@ class PatternDetector:
         Indicates: Impersonation, nervousness, or fatigue.
         """
         if len(self.history["keystroke_rhythm_variance"]) < 5:
-            return {"detected": False}
+            return _NOT_DETECTED
         
-        recent = list(self.history["keystroke_rhythm_variance"])[-5:]
-        older = list(self.history["keystroke_rhythm_variance"])[-10:-5] if len(self.history["keystroke_rhythm_variance"]) >= 10 else recent
+        values = list(self.history["keystroke_rhythm_variance"])
+        recent = values[-5:]
+        older = values[-10:-5] if len(values) >= 10 else recent
         
         if not older:
-            return {"detected": False}
+            return _NOT_DETECTED
         
-        recent_mean = statistics.mean(recent)
-        older_mean = statistics.mean(older)
+        recent_mean = _mean(recent)
+        older_mean = _mean(older)
         
         # If keystroke variance is suddenly much higher, something changed
         if recent_mean > older_mean * 1.5 and recent_mean > 0.5:
@@ -181,7 +195,7 @@ class PatternDetector:
                 "confidence": min(1.0, (recent_mean - older_mean) / 0.5),
             }
         
-        return {"detected": False}
+        return _NOT_DETECTED
     
     def _detect_focus_collapse(self) -> Dict[str, Any]:
         """
@@ -190,13 +204,14 @@ class PatternDetector:
         Indicates: Sudden distraction, stress, or resource constraints.
         """
         if len(self.history["focus_score"]) < 5:
-            return {"detected": False}
+            return _NOT_DETECTED
         
-        recent = list(self.history["focus_score"])[-5:]
-        older = list(self.history["focus_score"])[-10:-5] if len(self.history["focus_score"]) >= 10 else [0.7] * 5
+        values = list(self.history["focus_score"])
+        recent = values[-5:]
+        older = values[-10:-5] if len(values) >= 10 else [0.7] * 5
         
-        recent_mean = statistics.mean(recent)
-        older_mean = statistics.mean(older)
+        recent_mean = _mean(recent)
+        older_mean = _mean(older)
         
         # If focus dropped significantly
         if older_mean > 0.6 and recent_mean < 0.3 and (older_mean - recent_mean) > 0.3:
@@ -211,7 +226,7 @@ class PatternDetector:
                 "confidence": min(1.0, (older_mean - recent_mean) / 0.5),
             }
         
-        return {"detected": False}
+        return _NOT_DETECTED
     
     def _detect_stress_spike(self) -> Dict[str, Any]:
         """
@@ -220,13 +235,14 @@ class PatternDetector:
         Indicates: Anxiety, time pressure, or panic.
         """
         if len(self.history["stress_level"]) < 5:
-            return {"detected": False}
+            return _NOT_DETECTED
         
-        recent = list(self.history["stress_level"])[-5:]
-        older = list(self.history["stress_level"])[-10:-5] if len(self.history["stress_level"]) >= 10 else [0.2] * 5
+        values = list(self.history["stress_level"])
+        recent = values[-5:]
+        older = values[-10:-5] if len(values) >= 10 else [0.2] * 5
         
-        recent_mean = statistics.mean(recent)
-        older_mean = statistics.mean(older)
+        recent_mean = _mean(recent)
+        older_mean = _mean(older)
         
         # If stress increased suddenly
         if recent_mean > 0.6 and (recent_mean - older_mean) > 0.3:
@@ -241,7 +257,7 @@ class PatternDetector:
                 "confidence": min(1.0, (recent_mean - older_mean) / 0.5),
             }
         
-        return {"detected": False}
+        return _NOT_DETECTED
     
     def _detect_network_anomaly(self) -> Dict[str, Any]:
         """
@@ -250,13 +266,14 @@ class PatternDetector:
         Indicates: Data exfiltration or background processes.
         """
         if len(self.history["network_bytes"]) < 5:
-            return {"detected": False}
+            return _NOT_DETECTED
         
-        recent = list(self.history["network_bytes"])[-5:]
-        older = list(self.history["network_bytes"])[-10:-5] if len(self.history["network_bytes"]) >= 10 else [1000] * 5
+        values = list(self.history["network_bytes"])
+        recent = values[-5:]
+        older = values[-10:-5] if len(values) >= 10 else [1000] * 5
         
-        recent_mean = statistics.mean(recent)
-        older_mean = statistics.mean(older)
+        recent_mean = _mean(recent)
+        older_mean = _mean(older)
         
         # If network usage spiked significantly
         if recent_mean > 5 * 1024 * 1024 and recent_mean > older_mean * 3:  # 5MB spike
@@ -271,7 +288,7 @@ class PatternDetector:
                 "confidence": min(1.0, (recent_mean - older_mean) / (5 * 1024 * 1024)),
             }
         
-        return {"detected": False}
+        return _NOT_DETECTED
     
     def _detect_resource_exhaustion(self) -> Dict[str, Any]:
         """
@@ -280,11 +297,11 @@ class PatternDetector:
         Indicates: Running multiple programs or processes.
         """
         if len(self.history["cpu_usage"]) < 5:
-            return {"detected": False}
+            return _NOT_DETECTED
         
         recent = list(self.history["cpu_usage"])[-5:]
         
-        recent_mean = statistics.mean(recent)
+        recent_mean = _mean(recent)
         recent_max = max(recent)
         
         # If CPU is consistently high
@@ -300,7 +317,7 @@ class PatternDetector:
                 "confidence": min(1.0, (recent_mean - 75) / 25),
             }
         
-        return {"detected": False}
+        return _NOT_DETECTED
     
     def _detect_temporal_inconsistency(self) -> Dict[str, Any]:
         """
@@ -309,9 +326,9 @@ class PatternDetector:
         Indicates: Multi-location activity or automated behavior.
         """
         if len(self.history["timestamps"]) < 3:
-            return {"detected": False}
+            return _NOT_DETECTED
         
-        timestamps = [datetime.fromisoformat(ts) for ts in list(self.history["timestamps"])[-5:]]
+        timestamps = list(self.history["timestamps"])[-5:]
         
         # Check if timestamps are physically impossible
         inconsistencies = []
@@ -336,7 +353,7 @@ class PatternDetector:
                 "confidence": 0.9,
             }
         
-        return {"detected": False}
+        return _NOT_DETECTED
     
     def _calculate_overall_severity(self, patterns: List[Dict[str, Any]]) -> str:
         """Calculate overall severity from detected patterns."""
@@ -360,7 +377,7 @@ class PatternDetector:
             return 0.0
         
         confidences = [p.get("confidence", 0.5) for p in patterns]
-        return statistics.mean(confidences)
+        return _mean(confidences)
     
     def _get_recommendation(self, patterns: List[Dict[str, Any]]) -> str:
         """Get recommendation based on detected patterns."""
@@ -1,6 +1,13 @@
 # chrome_tiny_gemini_analyzer.py
 from __future__ import annotations
-from typing import Any, Dict, List, Optional
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
 
 # ---- Simple threshold: "tiny" if < 10% of screen area
 TINY_AREA_RATIO = 0.10
@@ -17,6 +24,14 @@ except Exception:
 
 GEMINI_MODEL = "gemini-1.5-flash"
 GEMINI_TIMEOUT_S = 10.0
+GEMINI_CACHE_SIZE = 512  # distinct fact sets whose model reply is kept
+GEMINI_CACHE_TTL_S = 30.0  # how long a cached reply may be reused
+GEMINI_CONCURRENCY = 8  # in-flight model calls; GEMINI_CONCURRENCY env overrides
+try:
+    # a bad value falls back to the default, and 0 would deadlock every call
+    GEMINI_CONCURRENCY = max(1, int(os.getenv("GEMINI_CONCURRENCY") or GEMINI_CONCURRENCY))
+except ValueError:
+    pass
 
 
 def _lower(x: Optional[str]) -> str:
@@ -63,59 +78,165 @@ def _make_model_facts(hits: List[Dict[str, Any]], tiny_foreground: bool, screen_
     sw, sh = screen_size.get("width"), screen_size.get("height")
     for i, w in enumerate(hits, 1):
         ar = w.get("area_ratio")
-        ar_str = "n/a" if ar is None else f"{ar:.3f}"
-        lines.append(
-            f"[Chrome#{i}] title={w.get('window_title')!r} focused={w.get('is_focused')} "
-            f"z_index={w.get('z_index')} visible={w.get('is_visible')} minimized={w.get('is_minimized')} "
-            f"bounds={w.get('bounds')} area_ratio={ar_str} tiny={w.get('is_tiny')} foreground={w.get('is_foreground')}"
+        fields = (
+            ("title", repr(w["window_title"]) if w.get("window_title") else None),
+            ("focused", w.get("is_focused")),
+            ("z_index", w.get("z_index")),
+            ("visible", w.get("is_visible")),
+            ("minimized", w.get("is_minimized")),
+            ("bounds", w.get("bounds") or None),
+            ("area_ratio", None if ar is None else f"{ar:.3f}"),
+            ("tiny", w.get("is_tiny")),
+            ("foreground", w.get("is_foreground")),
         )
+        # Drop absent values so sparse windows don't pad the prompt with "None"s
+        lines.append(f"[Chrome#{i}] " + " ".join(f"{k}={v}" for k, v in fields if v is not None))
     header = f"screen_size={{'width': {sw}, 'height': {sh}}}; tiny_foreground={tiny_foreground}; tiny_area_ratio<{TINY_AREA_RATIO}"
     return header + "\n" + ("\n".join(lines) if lines else "No Chrome windows found.")
 
 
-def _gemini_prompt(model_facts: str) -> str:
-    # STRICT JSON schema with exactly the fields requested.
-    return f"""
-You are writing a concise report entry.
+def _facts_fingerprint(hits: List[Dict[str, Any]], tiny_foreground: bool) -> bytes:
+    """Cache key from the verdict-relevant facts only.
 
-Given these facts:
-```
-{model_facts}
-```
+    Exact bounds and 3-decimal area ratios change whenever a window is nudged;
+    bucketing the ratio to 1% of the screen lets such near-identical snapshots
+    share one model reply.
+    """
+    parts: List[Any] = [tiny_foreground]
+    for w in hits:
+        ar = w.get("area_ratio")
+        parts.append((
+            w.get("window_title"),
+            w.get("is_tiny"),
+            w.get("is_foreground"),
+            w.get("is_focused"),
+            w.get("is_visible"),
+            bool(w.get("is_minimized")),
+            None if ar is None else round(ar, 2),
+        ))
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).digest()
+
+
+# Static prompt text, built once at import; only the facts vary per call.
+# The facts go last so every request shares a byte-identical prefix, which is
+# what Gemini's implicit prompt caching matches on.
+_PROMPT_PREFIX = """You are writing a concise report entry.
 
 Return STRICT JSON ONLY in this exact schema (no extra keys, no prose, no trailing comments):
-{{
+{
   "suspicious": boolean,           // true if Chrome is a tiny foreground window (per facts)
   "reason": string,                // short machine-friendly code, e.g. "chrome_tiny_foreground" or "no_chrome_tiny"
   "message": string,               // 1-2 sentence human summary, neutral and factual
   "confidence": number             // 0..1 conservative confidence
-}}
-""".strip()
+}
+
+Base it on these facts:
+```
+"""
+
+_PROMPT_SUFFIX = "\n```"
+
+
+def _gemini_prompt(model_facts: str) -> str:
+    # STRICT JSON schema with exactly the fields requested.
+    return _PROMPT_PREFIX + model_facts + _PROMPT_SUFFIX
+
+
+# Structured-output schema: the API constrains decoding to exactly this shape,
+# so replies arrive as bare JSON with every key present.
+_REPLY_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "suspicious": {"type": "BOOLEAN"},
+        "reason": {"type": "STRING"},
+        "message": {"type": "STRING"},
+        "confidence": {"type": "NUMBER"},
+    },
+    "required": ["suspicious", "reason", "message", "confidence"],
+}
+
 
+# Lazily-built process-wide client; reusing it keeps the HTTP connection pool warm.
+_CLIENT = None
 
-def _gemini_reason(model_facts: str) -> Dict[str, Any]:
+# Model replies keyed by a fingerprint of the facts. Clients resend (near-)identical
+# snapshots while the screen is unchanged, so repeats are answered without a round-trip.
+# Values are (expiry on the monotonic clock, reply).
+_REPLY_CACHE: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+# Model calls in flight, by the same key: concurrent identical snapshots
+# await one call instead of each making their own.
+_INFLIGHT: Dict[bytes, "asyncio.Task[Dict[str, Any]]"] = {}
+
+# Caps concurrent model calls across all connections so bursts queue here
+# instead of tripping the provider's rate limit.
+_GEMINI_SLOTS = asyncio.Semaphore(GEMINI_CONCURRENCY)
+
+
+def _get_client():
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = genai.Client()
+    return _CLIENT
+
+
+def _rule_based_reason(suspicious: bool) -> Dict[str, Any]:
+    """Simple rule-based message used when the model is skipped or unavailable."""
+    return {
+        "suspicious": suspicious,
+        "reason": "chrome_tiny_foreground" if suspicious else "no_chrome_tiny",
+        "message": (
+            "Chrome appears on screen as a tiny foreground window (<10% of screen area)."
+            if suspicious else
+            "No tiny foreground Chrome window detected."
+        ),
+        "confidence": 0.6 if suspicious else 0.5,
+        "source": "heuristic",
+    }
+
+
+async def _gemini_reason(model_facts: str, cache_key: bytes) -> Dict[str, Any]:
     if not _GENAI:
         # Fallback: simple rule-based message
         suspicious = "tiny_foreground=True" in model_facts or "tiny_foreground=True".lower() in model_facts.lower()
-        return {
-            "suspicious": bool(suspicious),
-            "reason": "chrome_tiny_foreground" if suspicious else "no_chrome_tiny",
-            "message": (
-                "Chrome appears on screen as a tiny foreground window (<10% of screen area)."
-                if suspicious else
-                "No tiny foreground Chrome window detected."
-            ),
-            "confidence": 0.6 if suspicious else 0.5,
-        }
-
+        return _rule_based_reason(bool(suspicious))
+
+    cached = _REPLY_CACHE.get(cache_key)
+    if cached is not None:
+        expires, reply = cached
+        if expires > time.monotonic():
+            _REPLY_CACHE.move_to_end(cache_key)
+            return dict(reply)
+        # stale: drop it and ask the model again
+        del _REPLY_CACHE[cache_key]
+
+    task = _INFLIGHT.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(_ask_gemini(model_facts, cache_key))
+        _INFLIGHT[cache_key] = task
+        task.add_done_callback(lambda _t: _INFLIGHT.pop(cache_key, None))
+    # shielded so one caller going away doesn't cancel the call the others share
+    return dict(await asyncio.shield(task))
+
+
+async def _ask_gemini(model_facts: str, cache_key: bytes) -> Dict[str, Any]:
     try:
-        client = genai.Client()
-        model = client.models.get(name=GEMINI_MODEL)
-        cfg = GenerateContentConfig(response_mime_type="application/json", temperature=0.0)
+        client = _get_client()
+        cfg = GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=_REPLY_SCHEMA,
+            temperature=0.0,
+        )
         prompt = _gemini_prompt(model_facts)
-        resp = client.models.generate_content(model=model.name, contents=prompt, config=cfg)
+        # The SDK's async client awaits the HTTP call natively, so no worker
+        # thread is tied up per request; only cache misses take a slot.
+        async with _GEMINI_SLOTS:
+            resp = await asyncio.wait_for(
+                client.aio.models.generate_content(model=GEMINI_MODEL, contents=prompt, config=cfg),
+                GEMINI_TIMEOUT_S,
+            )
         raw = resp.text if hasattr(resp, "text") else str(resp)
-        data = __import__("json").loads(raw)
+        data = orjson.loads(raw)
 
         # minimal schema guard
         for k in ("suspicious", "reason", "message", "confidence"):
@@ -125,6 +246,12 @@ def _gemini_reason(model_facts: str) -> Dict[str, Any]:
         # clamp confidence
         c = float(data.get("confidence") or 0.0)
         data["confidence"] = max(0.0, min(1.0, c))
+        data["source"] = "model"
+
+        # only genuine model replies are cached; fallbacks should retry next time
+        _REPLY_CACHE[cache_key] = (time.monotonic() + GEMINI_CACHE_TTL_S, data)
+        if len(_REPLY_CACHE) > GEMINI_CACHE_SIZE:
+            _REPLY_CACHE.popitem(last=False)
         return data
     except Exception:
         # conservative fallback if API flakes
@@ -133,6 +260,7 @@ def _gemini_reason(model_facts: str) -> Dict[str, Any]:
             "reason": "no_chrome_tiny",
             "message": "No tiny foreground Chrome window detected (model unavailable; used fallback).",
             "confidence": 0.4,
+            "source": "heuristic",
         }
 
 
@@ -147,10 +275,12 @@ async def analyze(data: Dict[str, Any]) -> Dict[str, Any]:
     esd = (data or {}).get("enhanced_screen_data", {}) or {}
     screen_layout = esd.get("screen_layout", {}) or {}
     primary = screen_layout.get("primary_monitor", {}) or {}
-    screen_size = {
-        "width": (primary.get("resolution") or [None, None])[0] if isinstance(primary.get("resolution"), list) else primary.get("width"),
-        "height": (primary.get("resolution") or [None, None])[1] if isinstance(primary.get("resolution"), list) else primary.get("height"),
-    }
+    res = primary.get("resolution")
+    if isinstance(res, list):
+        width, height = (res[:2] + [None, None])[:2]
+    else:
+        width, height = primary.get("width"), primary.get("height")
+    screen_size = {"width": width, "height": height}
     windows: List[Dict[str, Any]] = esd.get("active_windows") or []
 
     hits: List[Dict[str, Any]] = []
@@ -196,10 +326,20 @@ async def analyze(data: Dict[str, Any]) -> Dict[str, Any]:
         if info["is_tiny"] and fg:
             tiny_foreground = True
 
-    facts = _make_model_facts(hits, tiny_foreground, screen_size)
-    model_out = _gemini_reason(facts)
+    # Only ask the model when the facts leave room for judgement: a tiny
+    # foreground hit, or a Chrome window whose size couldn't be measured.
+    # No Chrome at all, or only measurably large/background Chrome, is a
+    # fixed "not suspicious" and doesn't need a model call.
+    ambiguous = tiny_foreground or any(w["area_ratio"] is None for w in hits)
+    if ambiguous:
+        # the prompt facts are only rendered for calls that may reach the model
+        facts = _make_model_facts(hits, tiny_foreground, screen_size)
+        model_out = await _gemini_reason(facts, _facts_fingerprint(hits, tiny_foreground))
+    else:
+        model_out = _rule_based_reason(False)
 
     suspicious = bool(model_out.get("suspicious"))
+    source = model_out.get("source", "heuristic")
     reason = str(model_out.get("reason") or ("chrome_tiny_foreground" if tiny_foreground else "no_chrome_tiny"))
     message = str(model_out.get("message") or ("Chrome is tiny in foreground." if tiny_foreground else "No tiny foreground Chrome."))
 
@@ -218,5 +358,7 @@ async def analyze(data: Dict[str, Any]) -> Dict[str, Any]:
             "screen_size": screen_size,
             "matches": hits,
         },
-        "model_used": GEMINI_MODEL if _GENAI else None,
+        # only name the model when its reply was actually used
+        "model_used": GEMINI_MODEL if source == "model" else None,
+        "source": source,
     }
@@ -11,13 +11,14 @@ Assumptions:
 from __future__ import annotations
 
 import os
-import json
 from datetime import datetime
 from typing import Optional
 import uuid
 
+import orjson
 from peewee import (
     Model,
+    BlobField,
     CharField,
     DateTimeField,
     IntegerField,
@@ -27,12 +28,30 @@ from peewee import (
 )
 from playhouse.sqlite_ext import SqliteExtDatabase, JSONField
 
+from utils import hash_access_code
+
 
 BASE_DIR = os.path.dirname(__file__)
 DB_FILENAME = os.path.join(BASE_DIR, "app.db")
 
 # Use the sqlite extension database so we can use JSONField on SQLite.
-db = SqliteExtDatabase(DB_FILENAME)
+# WAL lets the dashboard read while a report is being written, and
+# synchronous=NORMAL skips the per-commit fsync that WAL makes unnecessary.
+# Pragmas are applied by peewee on every new connection.
+db = SqliteExtDatabase(
+    DB_FILENAME,
+    pragmas={
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "temp_store": "memory",
+        "mmap_size": 256 * 1024 * 1024,
+    },
+)
+
+
+def _json_dumps(value) -> str:
+    # orjson returns bytes; SQLite's JSON1 functions expect TEXT
+    return orjson.dumps(value).decode()
 
 
 class BaseModel(Model):
@@ -43,7 +62,8 @@ class BaseModel(Model):
 class Device(BaseModel):
     id = UUIDField(primary_key=True, default=uuid.uuid4)
     name = CharField(max_length=255)
-    access_code = CharField(max_length=255, null=True)
+    access_code = CharField(max_length=255, null=True)  # legacy plaintext; migrated to access_code_hash
+    access_code_hash = BlobField(null=True, unique=True)  # sha256 of the code; authenticate looks devices up by it
     last_online = DateTimeField(null=True)
     last_session_time = IntegerField(null=True)  # seconds, nullable
 
@@ -59,10 +79,15 @@ class Report(BaseModel):
     reason = TextField(null=True)
     message = TextField(null=True)
     screen_shot_id = CharField(max_length=255, null=True)
-    data = JSONField(null=True)
+    data = JSONField(null=True, json_dumps=_json_dumps, json_loads=orjson.loads)
+
+    class Meta:
+        # A device's reports are always read newest-first; SQLite walks
+        # this index backwards for the DESC order instead of sorting.
+        indexes = ((("device", "timestamp"), False),)
 
     def __str__(self) -> str:
-        return f"Report(id={self.id}, device_id={self.device.id}, ts={self.timestamp})"
+        return f"Report(id={self.id}, device_id={self.device_id}, ts={self.timestamp})"
 
 
 def db_connect(create_tables: bool = True, path: Optional[str] = None):
@@ -90,10 +115,37 @@ def db_connect(create_tables: bool = True, path: Optional[str] = None):
     db.connect(reuse_if_open=True)
     if create_tables and need_create:
         db.create_tables([Device, Report])
+    elif create_tables:
+        # Existing file: bring columns up to date, then add any indexes
+        # declared since it was created
+        _migrate_access_codes()
+        for model in (Device, Report):
+            model._schema.create_indexes(safe=True)
 
     return db
 
 
+def _migrate_access_codes() -> None:
+    """Add Device.access_code_hash if missing and replace plaintext codes with their hash."""
+    columns = {c.name for c in db.get_columns(Device._meta.table_name)}
+    if "access_code_hash" not in columns:
+        db.execute_sql(f'ALTER TABLE "{Device._meta.table_name}" ADD COLUMN "access_code_hash" BLOB')
+
+    legacy = Device.select(Device.id, Device.access_code).where(Device.access_code.is_null(False))
+    with db.atomic():
+        for d in legacy:
+            (Device
+             .update(access_code_hash=hash_access_code(d.access_code), access_code=None)
+             .where(Device.id == d.id)
+             .execute())
+
+    # Earlier schemas indexed the hash without UNIQUE; drop that index so
+    # create_indexes() rebuilds it as a unique one
+    for idx in db.get_indexes(Device._meta.table_name):
+        if idx.columns == ["access_code_hash"] and not idx.unique:
+            db.execute_sql(f'DROP INDEX "{idx.name}"')
+
+
 def initialize_db(path: Optional[str] = None) -> str:
     """Compatibility wrapper that initializes the DB and returns its path."""
     db_connect(create_tables=True, path=path)
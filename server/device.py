@@ -1,140 +1,260 @@
+import logging
 import time
 import uuid
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from peewee import DatabaseError
 
 from db_init import db_connect, Device, Report
-from utils import generate_access_code, generate_token
+from utils import generate_access_code, generate_token, hash_access_code
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_TTL_S = 60.0  # how long a resolved access code skips the DB
+AUTH_CACHE_SIZE = 1024  # resolved access codes kept at once
+MIN_SESSION_WRITE_S = 5  # shorter sessions (reconnect flapping) don't update last_online
+SESSION_FLUSH_INTERVAL_S = 2.0  # how often the server flushes queued session writes
+SESSION_FLUSH_BATCH = 64  # queued session writes that force an early flush
+
+# The same few device ids arrive on every request; UUIDs are immutable, so
+# parsed values can be shared. Invalid strings raise and are not cached.
+_parse_uuid = lru_cache(maxsize=1024)(uuid.UUID)
+
 
 def _ensure_uuid(val: Any) -> uuid.UUID:
     if isinstance(val, uuid.UUID):
         return val
-    return uuid.UUID(str(val))
+    return _parse_uuid(val if isinstance(val, str) else str(val))
+
+
+# The serializers below hand back UUID and datetime objects as-is: main.py
+# encodes replies with orjson, which writes both natively in the same
+# canonical/ISO form str() and isoformat() would produce.
 
 
 def _device_to_dict(device: Device) -> Dict[str, Any]:
     return {
-        "id": str(device.id),
+        "id": device.id,
         "name": device.name,
-        "last_online": device.last_online.isoformat() if device.last_online else None,
+        "last_online": device.last_online,
         "last_session_time": device.last_session_time,
     }
 
 
-def _report_to_dict(report: Report) -> Dict[str, Any]:
+def _report_to_dict(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a Report row fetched with .dicts(); "device" holds the raw FK id."""
     return {
-        "id": str(report.id),
-        "device_id": str(report.device.id) if report.device else None,
-        "timestamp": report.timestamp.isoformat() if report.timestamp else None,
-        "reason": report.reason,
-        "message": report.message,
-        "screen_shot_id": report.screen_shot_id,
-        "data": report.data,
+        "id": row["id"],
+        "device_id": row["device"],
+        "timestamp": row["timestamp"],
+        "reason": row["reason"],
+        "message": row["message"],
+        "screen_shot_id": row["screen_shot_id"],
+        "data": row["data"],
     }
 
 
+def _safe_score(vals: Any) -> float:
+    """Category score as a float; malformed entries rank as 0."""
+    try:
+        return float((vals or {}).get("score") or 0.0)
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+class Session(NamedTuple):
+    """An authenticated connection; a tuple is far smaller than a 3-key dict."""
+    ws: Any
+    timestamp: float  # time.time() at authentication
+    device_id: uuid.UUID
+
+
 class Devices:
     def __init__(self, db=None):
         # db param for backwards compatibility; we prefer to use peewee models
         self._db = db_connect() if db is None else db
-        self.devices: Dict[str, Dict[str, Any]] = {}  # token -> session info
-        self.online: Dict[str, str] = {}  # device_id(str) -> token
+        self.devices: Dict[str, Session] = {}  # token -> session info
+        self.online: Dict[uuid.UUID, str] = {}  # device id -> token
+        self._ws_tokens: Dict[Any, Set[str]] = {}  # websocket -> tokens it authenticated
+        # device id -> (last_online, last_session_time) awaiting flush_sessions()
+        self._pending_session_writes: Dict[uuid.UUID, Tuple[datetime, int]] = {}
+        # sha256(access_code) -> (expiry on the monotonic clock, device id); raw codes are never kept
+        self._auth_cache: Dict[bytes, Tuple[float, uuid.UUID]] = {}
 
     def create_device(self, name: str) -> Dict[str, str]:
         access_code = generate_access_code()
-        d = Device.create(name=name, access_code=access_code)
+        # only the hash is stored; the plain code is returned to the caller once
+        d = Device.create(name=name, access_code_hash=hash_access_code(access_code))
         return {"id": str(d.id), "access_code": access_code}
 
     def remove_device(self, device_id: str) -> bool:
         try:
             did = _ensure_uuid(device_id)
+        except ValueError:
+            return False
+        try:
             deleted = Device.delete().where(Device.id == did).execute()
-            # If online, forget session
-            token = self.online.get(str(did))
-            if token:
-                self.forget(token)
-            return deleted > 0
-        except Exception:
+        except DatabaseError:
             return False
+        # a deleted device's access code must stop authenticating immediately
+        self._auth_cache.clear()
+        # Forget every session of the device, not just the newest one in `online`
+        for token in [t for t, sess in self.devices.items() if sess.device_id == did]:
+            self.forget(token)
+        return deleted > 0
 
     def edit_device(self, device_id: str, name: Optional[str] = None) -> bool:
         try:
             did = _ensure_uuid(device_id)
+        except ValueError:
+            return False
+        try:
             d = Device.get_or_none(Device.id == did)
             if not d:
                 return False
             if name is not None:
                 d.name = name
             d.save()
-            # update cached session device if present
-            token = self.online.get(str(did))
-            if token and token in self.devices:
-                self.devices[token]["device_id"] = str(d.id)
-            return True
-        except Exception:
+        except DatabaseError:
             return False
+        return True
 
     def get_device(self, device_id: str) -> Optional[Dict[str, Any]]:
         try:
             did = _ensure_uuid(device_id)
-            d = Device.get_or_none(Device.id == did)
+        except ValueError:
+            return None
+        try:
+            # Only the columns _device_to_dict serializes; access_code stays in the DB
+            d = (
+                Device.select(Device.id, Device.name, Device.last_online, Device.last_session_time)
+                .where(Device.id == did)
+                .get_or_none()
+            )
             if not d:
                 return None
+            # Stream plain row dicts: no Report instances, and peewee keeps no
+            # cached copy of the result set while the list is built
             reports = (
                 Report.select()
-                .where(Report.device == d)
+                .where(Report.device == did)
                 .order_by(Report.timestamp.desc())
+                .dicts()
+                .iterator()
             )
             return {"device": _device_to_dict(d), "reports": [_report_to_dict(r) for r in reports]}
-        except Exception:
+        except DatabaseError:
             return None
 
     def get_all_devices(self) -> List[Dict[str, Any]]:
-        devices = Device.select().order_by(Device.last_online.desc())
+        # Snapshot once: this runs in a worker thread while the event loop may
+        # be adding or dropping sessions.
+        online_ids = frozenset(self.online)
+        # Plain dicts of just the listed columns; no Device instances are built
+        devices = (
+            Device.select(Device.id, Device.name, Device.last_online, Device.last_session_time)
+            .order_by(Device.last_online.desc())
+            .dicts()
+        )
         out: List[Dict[str, Any]] = []
         for d in devices:
-            dd = _device_to_dict(d)
-            dd["is_online"] = str(d.id) in self.online
-            out.append(dd)
+            d["is_online"] = d["id"] in online_ids
+            out.append(d)
         return out
 
     def authenticate(self, ws, access_code: str) -> Optional[str]:
-        d = Device.get_or_none(Device.access_code == access_code)
-        if not d:
+        device_id = self._resolve_access_code(access_code)
+        if device_id is None:
             return None
         token = generate_token()
-        # store minimal session info
-        self.devices[token] = {"session": ws, "timestamp": time.time(), "device_id": str(d.id)}
-        self.online[str(d.id)] = token
+        # store minimal session info; the id stays a UUID so no later step re-parses it
+        self.devices[token] = Session(ws, time.time(), device_id)
+        self.online[device_id] = token
+        self._ws_tokens.setdefault(ws, set()).add(token)
         return token
 
-    def forget(self, token: str) -> bool:
-        if token in self.devices:
-            device_id = self.devices[token].get("device_id")
-            if device_id and device_id in self.online:
-                del self.online[device_id]
-            del self.devices[token]
-            try:
-                # try to recover session timestamp if still available; otherwise use now
-                sess = self.devices.get(token)
-                ts = sess.get("timestamp") if sess and "timestamp" in sess else time.time()
-                session_len = int(time.time() - ts) if sess and "timestamp" in sess else 0
-
-                if device_id:
-                    try:
-                        did = _ensure_uuid(device_id)
-                        d = Device.get_or_none(Device.id == did)
-                        if d:
-                            d.last_online = datetime.fromtimestamp(ts)
-                            d.last_session_time = session_len
-                            d.save()
-                    except Exception:
-                        pass
-            except Exception:
-                pass
+    def _resolve_access_code(self, access_code: str) -> Optional[uuid.UUID]:
+        """Device id for an access code, answering reconnect bursts from memory."""
+        if not access_code:
+            return None
+        key = hash_access_code(access_code)
+        now = time.monotonic()
+        cached = self._auth_cache.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        d = Device.get_or_none(Device.access_code_hash == key)
+        if not d:
+            self._auth_cache.pop(key, None)
+            return None
+        device_id = d.id
+        if len(self._auth_cache) >= AUTH_CACHE_SIZE:
+            # dicts keep insertion order, so this drops the oldest entry
+            del self._auth_cache[next(iter(self._auth_cache))]
+        self._auth_cache[key] = (now + AUTH_CACHE_TTL_S, device_id)
+        return device_id
+
+    def forget(self, token: str, flush: bool = False) -> bool:
+        sess = self.devices.pop(token, None)
+        if sess is None:
+            return True
+        # The device may already have reconnected on another socket; only clear
+        # its online entry if it still points at this session
+        if self.online.get(sess.device_id) == token:
+            del self.online[sess.device_id]
+        ws_tokens = self._ws_tokens.get(sess.ws)
+        if ws_tokens is not None:
+            ws_tokens.discard(token)
+
+        # Length comes from the popped entry; looking it up after deletion always gave 0
+        now = time.time()
+        session_len = int(now - sess.timestamp)
+        if session_len >= MIN_SESSION_WRITE_S:
+            self._pending_session_writes[sess.device_id] = (datetime.fromtimestamp(now), session_len)
+        if flush:
+            self.flush_sessions()
         return True
-    
+
+    def forget_session(self, ws) -> bool:
+        """Forget every token authenticated over a closed websocket.
+
+        Nothing is written here; returns True once SESSION_FLUSH_BATCH writes
+        are queued, so the caller can wake the flusher early.
+        """
+        for token in self._ws_tokens.pop(ws, ()):
+            self.forget(token)
+        return len(self._pending_session_writes) >= SESSION_FLUSH_BATCH
+
+    def flush_sessions(self) -> None:
+        """Write queued last_online/last_session_time values in one transaction."""
+        # Drain with popitem(): this runs on a worker thread while the event loop
+        # keeps queueing disconnects, and popitem is atomic where a swap is not
+        queue = self._pending_session_writes
+        pending = {}
+        while queue:
+            try:
+                did, write = queue.popitem()
+            except KeyError:
+                break
+            pending[did] = write
+        if not pending:
+            return
+        try:
+            # Plain UPDATEs: no per-device SELECT, and a single commit for the batch
+            with self._db.atomic():
+                for did, (last_online, session_len) in pending.items():
+                    (Device
+                     .update(last_online=last_online, last_session_time=session_len)
+                     .where(Device.id == did)
+                     .execute())
+        except DatabaseError as e:
+            # Requeue the batch; setdefault lets a write queued meanwhile win
+            for did, write in pending.items():
+                self._pending_session_writes.setdefault(did, write)
+            logger.warning("Session flush failed, %d writes requeued: %s", len(pending), e)
+
     def create_report_from_analysis(self, token: str, analysis: dict, package: dict | None = None) -> dict:
         """
         Create a Report row from an analyzer result.
@@ -149,57 +269,41 @@ class Devices:
             {"created": True, "report_id": "<uuid>"} on success, or
             {"created": False, "error": "..."} / {"created": False, "reason": "..."} on no-op.
         """
-        try:
-            # Validate session
-            sess = self.devices.get(token)
-            if not sess:
-                return {"created": False, "error": "Invalid token"}
-            device_id = sess.get("device_id")
-            if not device_id:
-                return {"created": False, "error": "Unknown device"}
-
-            # Require suspicious == True
-            if not isinstance(analysis, dict) or not analysis.get("suspicious", False):
-                return {"created": False, "reason": "Not suspicious"}
-
-            # Prefer Gemini-produced reason/message; fallback to top category
-            reason = analysis.get("reason")
-            message = analysis.get("message") or ""
-
-            if not reason:
-                cats = analysis.get("categories") or {}
-                top_name, top_score = None, float("-inf")
-                for name, vals in cats.items():
-                    try:
-                        s = float((vals or {}).get("score") or 0.0)
-                    except Exception:
-                        s = 0.0
-                    if s > top_score:
-                        top_name, top_score = name, s
-                reason = top_name or "suspicious_activity"
-
-            # Resolve device row (avoid changing your existing helpers)
-            import uuid
-            from db_init import Device, Report  # assumes your models are here
+        # Most analyses are clean; settle that before touching any session state
+        if not isinstance(analysis, dict) or not analysis.get("suspicious", False):
+            return {"created": False, "reason": "Not suspicious"}
 
-            try:
-                did = uuid.UUID(device_id)
-            except Exception:
-                # deterministic fallback if device_id isn't a UUID string
-                did = uuid.uuid5(uuid.NAMESPACE_DNS, device_id)
+        # Validate session
+        sess = self.devices.get(token)
+        if sess is None:
+            return {"created": False, "error": "Invalid token"}
+        did = sess.device_id
+
+        # Prefer Gemini-produced reason/message; fallback to top category
+        reason = analysis.get("reason")
+        message = analysis.get("message") or ""
+
+        if not reason:
+            cats = analysis.get("categories")
+            top_name = None
+            if isinstance(cats, dict):
+                top_name = max(cats, key=lambda name: _safe_score(cats[name]), default=None)
+            reason = top_name or "suspicious_activity"
+
+        # Optional screenshot passthrough
+        screen_shot_id = None
+        if isinstance(package, dict):
+            screen_shot_id = package.get("screen_shot_id")
+            if not screen_shot_id:
+                pdata = (package.get("data") or {}) if isinstance(package.get("data"), dict) else {}
+                screen_shot_id = pdata.get("screen_shot_id")
 
+        try:
+            # Resolve device row
             d = Device.get_or_none(Device.id == did)
             if not d:
                 return {"created": False, "error": "Device not found"}
 
-            # Optional screenshot passthrough
-            screen_shot_id = None
-            if isinstance(package, dict):
-                screen_shot_id = package.get("screen_shot_id")
-                if not screen_shot_id:
-                    pdata = (package.get("data") or {}) if isinstance(package.get("data"), dict) else {}
-                    screen_shot_id = pdata.get("screen_shot_id")
-
             # Persist report
             r = Report.create(
                 device=d,
@@ -208,9 +312,20 @@ class Devices:
                 screen_shot_id=screen_shot_id,
                 data=analysis,  # store full analysis payload for audit
             )
-            return {"created": True, "report_id": str(r.id)}
-
-        except Exception as e:
+        # TypeError covers an analysis payload orjson can't encode
+        except (DatabaseError, TypeError) as e:
             return {"created": False, "error": f"{e.__class__.__name__}: {e}"}
+        return {"created": True, "report_id": str(r.id)}
+
+
+# One registry per process: sessions authenticated on one connection must be
+# visible to the dashboard's connection (is_online) and to its cleanup.
+_instance: Optional[Devices] = None
 
 
+def get_devices() -> Devices:
+    """Return the process-wide Devices registry, creating it on first use."""
+    global _instance
+    if _instance is None:
+        _instance = Devices()
+    return _instance
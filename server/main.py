@@ -1,35 +1,35 @@
-import asyncio, json
+import asyncio
+import orjson
 import websockets
-from websockets.asyncio.server import serve
 
-from db_init import db_connect
-from device import Devices
+from device import SESSION_FLUSH_INTERVAL_S, get_devices
 from analyze import analyze
     
+# set by handlers when enough disconnects are queued to flush before the next tick
+flush_due = asyncio.Event()
+
 
 async def handler(ws):
-    db = db_connect()
-    device_manager = Devices(db)
+    device_manager = get_devices()
     response = {}
 
-    print(device_manager.devices)
-
     try:
         async for raw in ws:
             try:
-                message = json.loads(raw)
+                message = orjson.loads(raw)
                 method = message.get("method")
                 data = message.get("data", {})
 
                 # handle incoming methods in a single dispatch
                 match method:
                     case "GetAllDevices":
-                        devices = device_manager.get_all_devices()
+                        # DB reads run in a worker thread so other connections keep flowing
+                        devices = await asyncio.to_thread(device_manager.get_all_devices)
                         response = {"status": "success", "data": devices}
 
                     case "GetDevice":
                         device_id = data.get("device_id")
-                        device_info = device_manager.get_device(device_id)
+                        device_info = await asyncio.to_thread(device_manager.get_device, device_id)
                         if device_info:
                             response = {"status": "success", "data": device_info}
                         else:
@@ -60,7 +60,6 @@ async def handler(ws):
 
                     case "Authenticate":
                         access_code = data.get("access_code")
-                        print("Authenticating with access code:", access_code)
                         token = device_manager.authenticate(ws, access_code)
                         if token:
                             response = {"status": "success", "data": {"token": token}}
@@ -69,11 +68,17 @@ async def handler(ws):
 
                     case "Package":
                         token = data.get("token")
-                        print("Received package with token:", token)
                         if token in device_manager.devices:
                             analyzed = await analyze(data)
-                            saved = device_manager.create_report_from_analysis(device_manager, token, analyzed, data)
                             response = {"status": "success"}
+                            # only suspicious analyses become reports; skip the thread hop otherwise
+                            if analyzed.get("suspicious"):
+                                # persist off the event loop so other clients aren't stalled on the DB write
+                                saved = await asyncio.to_thread(
+                                    device_manager.create_report_from_analysis, token, analyzed, data
+                                )
+                                if not saved.get("created"):
+                                    response = {"status": "error", "message": f"Failed to save report: {saved.get('error')}"}
 
                         else:
                             response = {"status": "error", "message": "Invalid token"}
@@ -81,23 +86,42 @@ async def handler(ws):
                     case _:
                         response = {"status": "error", "message": "Unknown method"}
 
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 response = {"status": "error", "message": "Invalid JSON"}
             except Exception as exc:
                 response = {"status": "error", "message": f"Server error: {exc}"}
 
-            await ws.send(json.dumps(response))
+            # decode so the dashboard still receives text frames
+            await ws.send(orjson.dumps(response).decode())
     finally:
         # Clean up session when WebSocket connection closes
-        tokens = [t for t, info in device_manager.devices.items() if info.get("session") is ws]
-        for t in tokens:
-            device_manager.forget(t)
+        if device_manager.forget_session(ws):
+            flush_due.set()
 
 
+async def flush_sessions_periodically():
+    device_manager = get_devices()
+    try:
+        while True:
+            # wake on the interval, or early once a batch of disconnects is queued
+            try:
+                await asyncio.wait_for(flush_due.wait(), SESSION_FLUSH_INTERVAL_S)
+            except asyncio.TimeoutError:
+                pass
+            flush_due.clear()
+            await asyncio.to_thread(device_manager.flush_sessions)
+    finally:
+        # don't lose sessions queued since the last tick on shutdown
+        device_manager.flush_sessions()
+
 
 async def main():
-    async with websockets.serve(handler, "localhost", 8765):
-        print("WebSocket server on ws://localhost:8765")
-        await asyncio.Future()  # run forever
+    flusher = asyncio.create_task(flush_sessions_periodically())
+    try:
+        async with websockets.serve(handler, "localhost", 8765):
+            print("WebSocket server on ws://localhost:8765")
+            await asyncio.Future()  # run forever
+    finally:
+        flusher.cancel()
 
 asyncio.run(main())
\ No newline at end of file
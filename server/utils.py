@@ -8,4 +8,14 @@ def generate_access_code():
 def generate_token():
     import uuid
 
-    return uuid.uuid4().hex
\ No newline at end of file
+    return uuid.uuid4().hex
+
+
+def hash_access_code(access_code):
+    import hashlib
+
+    # Devices are stored and looked up by this digest; the plain code is never kept.
+    # An unsalted fast hash is enough here: codes are random 10-character
+    # [A-Z0-9] tokens from generate_access_code, not user-chosen passwords,
+    # and a fixed digest is what lets authenticate find the device by index.
+    return hashlib.sha256(str(access_code).encode("utf-8")).digest()